@@ -1,25 +1,124 @@
 # api.py
 import os
-from fastapi import FastAPI, Depends, HTTPException, status
+import hashlib
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from fastapi import FastAPI, Header, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
 from dotenv import load_dotenv
 from datetime import datetime, date
-import pandas as pd
+from cachetools import TTLCache
+import asyncpg
+import orjson
 
 # --- Load Environment Variables ---
 load_dotenv()
 DB_CONNECTION_STRING = os.getenv("SUPABASE_CONNECTION_STRING")
 
 # --- Database Connection ---
+# Pool sized for a single Uvicorn worker. pre_ping swaps out SSL connections that
+# Supabase dropped while idle, and recycle retires them before the server does.
+# Behind PgBouncer in transaction mode (port 6432), append
+# `?prepared_statement_cache_size=0` to the connection string: prepared statements
+# do not survive a change of server connection. SQLAlchemy reads that parameter
+# itself; _asyncpg_pool_args strips it for pg_pool and applies it as asyncpg's
+# statement_cache_size, since asyncpg would send it to the server as a setting.
 try:
     if not DB_CONNECTION_STRING:
         raise ValueError("SUPABASE_CONNECTION_STRING not found in .env file or environment variables.")
-    engine = create_engine(DB_CONNECTION_STRING)
+    engine = create_async_engine(
+        DB_CONNECTION_STRING.replace("postgresql://", "postgresql+asyncpg://", 1),
+        pool_size=20, max_overflow=10, pool_timeout=30, pool_pre_ping=True, pool_recycle=1800,
+    )
 except Exception as e:
     print(f"🔥 FAILED TO CREATE DATABASE ENGINE: {e}")
     engine = None
 
+# Bare asyncpg pool for the hottest reads, which skip SQLAlchemy's per-execute overhead.
+# Created on startup because asyncpg pools must be built inside the running event loop.
+pg_pool: asyncpg.Pool | None = None
+
+def _asyncpg_pool_args(dsn: str) -> tuple[str, int]:
+    """Returns the DSN without SQLAlchemy-only query parameters, and the statement cache size for pg_pool."""
+    parts = urlsplit(dsn)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    cache_size = int(query.pop("prepared_statement_cache_size", 256))
+    return urlunsplit(parts._replace(query=urlencode(query))), cache_size
+
+# --- SQL Statements ---
+SCHEMA_DDL = """
+CREATE TABLE IF NOT EXISTS subjects (
+    SubjectID SERIAL PRIMARY KEY, username TEXT NOT NULL, SubjectLabel TEXT NOT NULL,
+    DateCreated TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE TABLE IF NOT EXISTS definitions (
+    DefinitionID SERIAL PRIMARY KEY, SubjectID INT REFERENCES subjects(SubjectID) ON DELETE CASCADE,
+    username TEXT NOT NULL, BehaviorName TEXT NOT NULL, Description TEXT
+);
+CREATE TABLE IF NOT EXISTS daily_scores (
+    LogID SERIAL PRIMARY KEY, DefinitionID INT REFERENCES definitions(DefinitionID) ON DELETE CASCADE,
+    username TEXT NOT NULL, Date DATE NOT NULL, Score INT, Notes TEXT
+);
+CREATE TABLE IF NOT EXISTS feedback (
+    FeedbackID SERIAL PRIMARY KEY, username TEXT NOT NULL, submitted_at TIMESTAMPTZ DEFAULT NOW(),
+    feedback_text TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_subjects_user ON subjects (username, subjectlabel);
+CREATE INDEX IF NOT EXISTS idx_definitions_user ON definitions (username, subjectid, behaviorname);
+CREATE INDEX IF NOT EXISTS idx_scores_user_date ON daily_scores (username, date DESC);
+CREATE INDEX IF NOT EXISTS idx_scores_user_def_date ON daily_scores (username, definitionid, date);"""
+
+# Column lists mirror the Subject / Definition / Score response models.
+SUBJECT_COLUMNS = "subjectid, username, subjectlabel, datecreated"
+DEFINITION_COLUMNS = "definitionid, subjectid, username, behaviorname, description"
+SCORE_COLUMNS = "logid, definitionid, username, date, score, notes"
+
+SQL_INSERT_SUBJECT = text(f"INSERT INTO subjects (username, subjectlabel, datecreated) VALUES (:user, :label, :date) RETURNING {SUBJECT_COLUMNS}")
+SQL_UPDATE_SUBJECT = text(f"UPDATE subjects SET subjectlabel = :label WHERE subjectid = :id AND username = :user RETURNING {SUBJECT_COLUMNS}")
+SQL_DELETE_SUBJECT = text("DELETE FROM subjects WHERE subjectid = :id AND username = :user")
+SQL_INSERT_DEFINITION = text(f"WITH ins AS (INSERT INTO definitions (subjectid, username, behaviorname, description) VALUES (:sid, :user, :bname, :desc) RETURNING {DEFINITION_COLUMNS}) SELECT ins.*, s.subjectlabel FROM ins JOIN subjects s ON s.subjectid = ins.subjectid")
+SQL_SELECT_DEFINITIONS = text("SELECT d.definitionid, d.subjectid, d.username, d.behaviorname, d.description, s.subjectlabel FROM definitions d JOIN subjects s ON d.subjectid = s.subjectid WHERE d.username = :user ORDER BY s.subjectlabel, d.behaviorname")
+SQL_UPDATE_DEFINITION = text(f"WITH upd AS (UPDATE definitions SET behaviorname = :bname, description = :desc WHERE definitionid = :id AND username = :user RETURNING {DEFINITION_COLUMNS}) SELECT upd.*, s.subjectlabel FROM upd JOIN subjects s ON s.subjectid = upd.subjectid")
+SQL_DELETE_DEFINITION = text("DELETE FROM definitions WHERE definitionid = :id AND username = :user")
+SQL_INSERT_SCORE = text(f"INSERT INTO daily_scores (definitionid, username, date, score, notes) VALUES (:did, :user, :date, :score, :notes) RETURNING {SCORE_COLUMNS}")
+SQL_INSERT_SCORES = text(f"""
+    INSERT INTO daily_scores (definitionid, username, date, score, notes)
+    SELECT did, :user, d, s, n
+    FROM unnest(CAST(:dids AS INT[]), CAST(:dates AS DATE[]), CAST(:scores AS INT[]), CAST(:notes AS TEXT[])) AS t(did, d, s, n)
+    RETURNING {SCORE_COLUMNS}""")
+# Weekly (ISO year/week) and monthly (calendar year/month) averages from one scan. Each row
+# belongs to one grouping set; the other set's keys come back NULL and `weekly` says which.
+# timeperiod is the chart label ("2024-W07" / "2024-Jan"); the NULL keys null out the other
+# set's label, so COALESCE picks the right one.
+SQL_AVERAGES = text("""
+    SELECT definitionid,
+           COALESCE(EXTRACT(ISOYEAR FROM date), EXTRACT(YEAR FROM date))::int AS year,
+           EXTRACT(WEEK FROM date)::int AS weekofyear, EXTRACT(MONTH FROM date)::int AS month,
+           COALESCE(
+               EXTRACT(ISOYEAR FROM date)::int || '-W' || lpad(EXTRACT(WEEK FROM date)::int::text, 2, '0'),
+               to_char(make_date(EXTRACT(YEAR FROM date)::int, EXTRACT(MONTH FROM date)::int, 1), 'YYYY-Mon')
+           ) AS timeperiod,
+           AVG(score)::float AS averagescore, COUNT(*) AS datapointscount,
+           GROUPING(EXTRACT(MONTH FROM date)) = 1 AS weekly
+    FROM daily_scores WHERE username = :user AND date IS NOT NULL AND score IS NOT NULL
+    GROUP BY GROUPING SETS (
+        (definitionid, EXTRACT(ISOYEAR FROM date), EXTRACT(WEEK FROM date)),
+        (definitionid, EXTRACT(YEAR FROM date), EXTRACT(MONTH FROM date))
+    )
+    ORDER BY definitionid, year, weekofyear, month""")
+WEEKLY_AVERAGE_KEYS = ("definitionid", "year", "weekofyear", "timeperiod", "averagescore", "datapointscount")
+MONTHLY_AVERAGE_KEYS = ("definitionid", "year", "month", "timeperiod", "averagescore", "datapointscount")
+# Raw asyncpg queries ($n placeholders) served from pg_pool
+PG_SELECT_SUBJECTS = f"SELECT {SUBJECT_COLUMNS} FROM subjects WHERE username = $1 ORDER BY subjectlabel"
+PG_SELECT_SCORES = f"SELECT {SCORE_COLUMNS} FROM daily_scores WHERE username = $1 ORDER BY date DESC"
+# Scores are only ever inserted or cascade-deleted, so (count, newest id) changes whenever the list does.
+# It aggregates over all of the user's rows; only the result is one row.
+PG_SCORES_VERSION = "SELECT COUNT(*), COALESCE(MAX(logid), 0) FROM daily_scores WHERE username = $1"
+SQL_INSERT_FEEDBACK = text("INSERT INTO feedback (username, feedback_text) VALUES (:user, :text)")
+
 # --- Pydantic Models (Data Validation) ---
 class SubjectCreate(BaseModel):
     subject_label: str
@@ -61,229 +160,284 @@ app = FastAPI()
 
 # --- NEW: Database Initialization on Startup ---
 @app.on_event("startup")
-def on_startup():
-    """Ensures all database tables exist when the API starts."""
+async def on_startup():
+    """Ensures all database tables exist and opens the asyncpg read pool when the API starts."""
+    global pg_pool
     if engine is None:
         print("Skipping database initialization because engine failed to create.")
         return
         
     print("--- Verifying database tables on startup ---")
-    create_subjects_table = text("""
-    CREATE TABLE IF NOT EXISTS subjects (
-        SubjectID SERIAL PRIMARY KEY, username TEXT NOT NULL, SubjectLabel TEXT NOT NULL,
-        DateCreated TIMESTAMPTZ DEFAULT NOW()
-    );""")
-    create_definitions_table = text("""
-    CREATE TABLE IF NOT EXISTS definitions (
-        DefinitionID SERIAL PRIMARY KEY, SubjectID INT REFERENCES subjects(SubjectID) ON DELETE CASCADE,
-        username TEXT NOT NULL, BehaviorName TEXT NOT NULL, Description TEXT
-    );""")
-    create_scores_table = text("""
-    CREATE TABLE IF NOT EXISTS daily_scores (
-        LogID SERIAL PRIMARY KEY, DefinitionID INT REFERENCES definitions(DefinitionID) ON DELETE CASCADE,
-        username TEXT NOT NULL, Date DATE NOT NULL, Score INT, Notes TEXT
-    );""")
-    create_feedback_table = text("""
-    CREATE TABLE IF NOT EXISTS feedback (
-        FeedbackID SERIAL PRIMARY KEY, username TEXT NOT NULL, submitted_at TIMESTAMPTZ DEFAULT NOW(),
-        feedback_text TEXT
-    );""")
-    
     try:
-        with engine.connect() as connection:
-            connection.execute(create_subjects_table)
-            connection.execute(create_definitions_table)
-            connection.execute(create_scores_table)
-            connection.execute(create_feedback_table)
-            connection.commit()
+        # asyncpg prepares every statement SQLAlchemy sends, and a prepared statement holds
+        # one command. The driver's own execute() takes the simple-query path instead, so
+        # the whole script goes over in a single round-trip and a single transaction.
+        async with engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.execute(SCHEMA_DDL)
         print("--- Database tables verified successfully ---")
     except Exception as e:
         print(f"🔥 DATABASE TABLE CREATION FAILED: {e}")
 
+    try:
+        pool_dsn, statement_cache_size = _asyncpg_pool_args(DB_CONNECTION_STRING)
+        pg_pool = await asyncpg.create_pool(pool_dsn, min_size=5, max_size=20, statement_cache_size=statement_cache_size)
+    except Exception as e:
+        print(f"🔥 FAILED TO CREATE ASYNCPG POOL: {e}")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Closes both connection pools so pooled connections are released cleanly."""
+    if pg_pool is not None:
+        await pg_pool.close()
+    if engine is not None:
+        await engine.dispose()
+
+
+# --- Database Helpers ---
+async def _fetch_all(sql, params: dict):
+    """Runs a read on a pooled connection and returns every row as a mapping."""
+    async with engine.connect() as connection:
+        return (await connection.execute(sql, params)).mappings().all()
+
+async def _fetch_one(sql, params: dict):
+    """Runs a statement in its own transaction and returns the first row, or None."""
+    async with engine.begin() as connection:
+        return (await connection.execute(sql, params)).mappings().first()
+
+async def _pg_fetch(query: str, *args):
+    """Runs a read straight on the asyncpg pool; asyncpg caches the prepared statement by query text."""
+    async with pg_pool.acquire() as connection:
+        return await connection.fetch(query, *args)
+
+async def _execute(sql, params: dict) -> int:
+    """Runs a write in its own transaction and returns the number of affected rows."""
+    async with engine.begin() as connection:
+        return (await connection.execute(sql, params)).rowcount
+
+
+# --- Read Cache ---
+# Per-process cache of (ETag, encoded JSON body) keyed by (resource, username). A miss awaits
+# the database before storing, so a write can commit and invalidate in between; _cached_json
+# checks the user's data version across that await and skips storing a body that is stale.
+read_cache = TTLCache(maxsize=1024, ttl=30)
+
+# Per-user data version, bumped by every write, so clients can check one scalar before
+# re-reading whole tables. The boot stamp keeps versions from repeating after a restart.
+BOOT_ID = time.time_ns()
+data_versions: dict[str, int] = {}
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    return if_none_match is not None and etag in (tag.strip() for tag in if_none_match.split(","))
+
+async def _cached_json(resource: str, username: str, load, if_none_match: str | None = None) -> Response:
+    """Serves a read from the cache, awaiting `load()` and encoding its result on a miss.
+
+    Answers 304 when the client already holds the current body. Returning a Response directly
+    skips FastAPI's per-row response_model validation; the route's response_model still
+    documents the shape.
+    """
+    key = (resource, username)
+    entry = read_cache.get(key)
+    if entry is None:
+        version = data_versions.get(username, 0) # read before the await: a write during load() bumps it
+        body = orjson.dumps(await load(), default=dict) # default=dict encodes RowMappings and asyncpg Records
+        entry = (f'"{hashlib.md5(body).hexdigest()}"', body)
+        if data_versions.get(username, 0) == version: # else the rows may predate the write; serve them once, uncached
+            read_cache[key] = entry
+    etag, body = entry
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+def _invalidate(username: str, *resources: str):
+    """Drops cached reads for a user after a write touched those resources, and bumps their data version."""
+    data_versions[username] = data_versions.get(username, 0) + 1
+    for resource in resources:
+        read_cache.pop((resource, username), None)
+
 
 # --- "Dummy" Authentication ---
-def get_current_user():
-    return "RKBobe"
+# A constant until real auth exists; restore a Depends() resolver when it does.
+CURRENT_USER = "RKBobe"
 
 # --- API Endpoints ---
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to the BeeHayv API!"}
 
 @app.get("/health")
-def health_check():
+async def health_check():
     if engine is None: raise HTTPException(status_code=500, detail="Database connection failed")
+    if pg_pool is None: raise HTTPException(status_code=500, detail="asyncpg read pool unavailable")
     return {"status": "ok", "database_connection": "successful"}
 
+@app.get("/version")
+async def get_version():
+    """A token that changes whenever the user's subjects, definitions or scores change."""
+    return {"version": f"{BOOT_ID}-{data_versions.get(CURRENT_USER, 0)}"}
+
 # --- Subjects Endpoints ---
 @app.post("/subjects", response_model=Subject)
-def add_subject(subject: SubjectCreate, current_user: str = Depends(get_current_user)):
-    sql = text("INSERT INTO subjects (username, subjectlabel, datecreated) VALUES (:user, :label, :date) RETURNING *")
-    params = {"user": current_user, "label": subject.subject_label.strip(), "date": datetime.now()}
+async def add_subject(subject: SubjectCreate):
+    params = {"user": CURRENT_USER, "label": subject.subject_label.strip(), "date": datetime.now()}
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, params).mappings().first()
-            connection.commit()
+        result = await _fetch_one(SQL_INSERT_SUBJECT, params)
+        _invalidate(CURRENT_USER, "subjects")
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/subjects", response_model=list[Subject])
-def get_subjects(current_user: str = Depends(get_current_user)):
-    sql = text("SELECT * FROM subjects WHERE username = :user ORDER BY subjectlabel")
+async def get_subjects(if_none_match: str | None = Header(default=None)):
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, {"user": current_user}).mappings().all()
-        return result
+        return await _cached_json("subjects", CURRENT_USER, lambda: _pg_fetch(PG_SELECT_SUBJECTS, CURRENT_USER), if_none_match)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/subjects/{subject_id}", response_model=Subject)
-def update_subject(subject_id: int, subject: SubjectUpdate, current_user: str = Depends(get_current_user)):
-    sql = text("UPDATE subjects SET subjectlabel = :label WHERE subjectid = :id AND username = :user RETURNING *")
-    params = {"label": subject.subject_label, "id": subject_id, "user": current_user}
+async def update_subject(subject_id: int, subject: SubjectUpdate):
+    params = {"label": subject.subject_label, "id": subject_id, "user": CURRENT_USER}
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, params).mappings().first()
-            connection.commit()
+        result = await _fetch_one(SQL_UPDATE_SUBJECT, params)
         if result is None:
             raise HTTPException(status_code=404, detail="Subject not found or user does not have permission")
+        _invalidate(CURRENT_USER, "subjects", "definitions")
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/subjects/{subject_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_subject(subject_id: int, current_user: str = Depends(get_current_user)):
-    sql = text("DELETE FROM subjects WHERE subjectid = :id AND username = :user")
-    params = {"id": subject_id, "user": current_user}
+async def delete_subject(subject_id: int):
+    params = {"id": subject_id, "user": CURRENT_USER}
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, params)
-            if result.rowcount == 0:
-                 raise HTTPException(status_code=404, detail="Subject not found or user does not have permission")
-            connection.commit()
+        if await _execute(SQL_DELETE_SUBJECT, params) == 0:
+            raise HTTPException(status_code=404, detail="Subject not found or user does not have permission")
+        _invalidate(CURRENT_USER, "subjects", "definitions", "averages")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- Definitions Endpoints ---
-def _get_single_definition(connection, username: str, definition_id: int):
-    sql = text("SELECT d.*, s.subjectlabel FROM definitions d JOIN subjects s ON d.subjectid = s.subjectid WHERE d.username = :user AND d.definitionid = :did")
-    return connection.execute(sql, {"user": username, "did": definition_id}).mappings().first()
-
 @app.post("/definitions", response_model=Definition)
-def add_definition(definition: DefinitionCreate, current_user: str = Depends(get_current_user)):
-    sql = text("INSERT INTO definitions (subjectid, username, behaviorname, description) VALUES (:sid, :user, :bname, :desc) RETURNING *")
-    params = {"sid": definition.subject_id, "user": current_user, "bname": definition.behavior_name.strip(), "desc": definition.description}
+async def add_definition(definition: DefinitionCreate):
+    params = {"sid": definition.subject_id, "user": CURRENT_USER, "bname": definition.behavior_name.strip(), "desc": definition.description}
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, params).mappings().first()
-            connection.commit()
-            if result:
-                return _get_single_definition(connection, current_user, result['definitionid'])
+        result = await _fetch_one(SQL_INSERT_DEFINITION, params)
+        _invalidate(CURRENT_USER, "definitions")
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/definitions", response_model=list[Definition])
-def get_definitions(current_user: str = Depends(get_current_user)):
-    sql = text("SELECT d.*, s.subjectlabel FROM definitions d JOIN subjects s ON d.subjectid = s.subjectid WHERE d.username = :user ORDER BY s.subjectlabel, d.behaviorname")
+async def get_definitions(if_none_match: str | None = Header(default=None)):
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, {"user": current_user}).mappings().all()
-        return result
+        return await _cached_json("definitions", CURRENT_USER, lambda: _fetch_all(SQL_SELECT_DEFINITIONS, {"user": CURRENT_USER}), if_none_match)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/definitions/{definition_id}", response_model=Definition)
-def update_definition(definition_id: int, definition: DefinitionUpdate, current_user: str = Depends(get_current_user)):
-    sql = text("UPDATE definitions SET behaviorname = :bname, description = :desc WHERE definitionid = :id AND username = :user")
-    params = {"bname": definition.behavior_name, "desc": definition.description, "id": definition_id, "user": current_user}
+async def update_definition(definition_id: int, definition: DefinitionUpdate):
+    params = {"bname": definition.behavior_name, "desc": definition.description, "id": definition_id, "user": CURRENT_USER}
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, params)
-            if result.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Definition not found or user does not have permission")
-            connection.commit()
-            return _get_single_definition(connection, current_user, definition_id)
+        result = await _fetch_one(SQL_UPDATE_DEFINITION, params)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Definition not found or user does not have permission")
+        _invalidate(CURRENT_USER, "definitions")
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/definitions/{definition_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_definition(definition_id: int, current_user: str = Depends(get_current_user)):
-    sql = text("DELETE FROM definitions WHERE definitionid = :id AND username = :user")
-    params = {"id": definition_id, "user": current_user}
+async def delete_definition(definition_id: int):
+    params = {"id": definition_id, "user": CURRENT_USER}
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, params)
-            if result.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Definition not found or user does not have permission")
-            connection.commit()
+        if await _execute(SQL_DELETE_DEFINITION, params) == 0:
+            raise HTTPException(status_code=404, detail="Definition not found or user does not have permission")
+        _invalidate(CURRENT_USER, "definitions", "averages")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- Scores Endpoints ---
 @app.post("/scores", response_model=Score)
-def add_score(score: ScoreCreate, current_user: str = Depends(get_current_user)):
-    sql = text("INSERT INTO daily_scores (definitionid, username, date, score, notes) VALUES (:did, :user, :date, :score, :notes) RETURNING *")
-    params = {"did": score.definition_id, "user": current_user, "date": score.score_date, "score": score.score, "notes": score.notes}
+async def add_score(score: ScoreCreate):
+    params = {"did": score.definition_id, "user": CURRENT_USER, "date": score.score_date, "score": score.score, "notes": score.notes}
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, params).mappings().first()
-            connection.commit()
+        result = await _fetch_one(SQL_INSERT_SCORE, params)
+        _invalidate(CURRENT_USER, "averages")
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/scores", response_model=list[Score])
-def get_scores(current_user: str = Depends(get_current_user)):
-    sql = text("SELECT * FROM daily_scores WHERE username = :user ORDER BY date DESC")
+@app.post("/scores/batch", response_model=list[Score])
+async def add_scores(scores: list[ScoreCreate]):
+    """Inserts many scores with one statement: each column travels as an array and unnest() zips them into rows."""
+    if not scores: return []
+    params = {
+        "user": CURRENT_USER,
+        "dids": [s.definition_id for s in scores],
+        "dates": [s.score_date for s in scores],
+        "scores": [s.score for s in scores],
+        "notes": [s.notes for s in scores],
+    }
     try:
-        with engine.connect() as connection:
-            result = connection.execute(sql, {"user": current_user}).mappings().all()
+        async with engine.begin() as connection:
+            result = (await connection.execute(SQL_INSERT_SCORES, params)).mappings().all()
+        _invalidate(CURRENT_USER, "averages")
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# --- Averages Endpoint ---
-@app.get("/averages", response_model=Averages)
-def get_averages(current_user: str = Depends(get_current_user)):
-    sql = text("SELECT * FROM daily_scores WHERE username = :user")
+async def _stream_scores(username: str):
+    """Yields the user's scores as NDJSON, one server-side cursor batch at a time."""
+    async with pg_pool.acquire() as connection, connection.transaction(): # asyncpg cursors need a transaction
+        cursor = await connection.cursor(PG_SELECT_SCORES, username)
+        while rows := await cursor.fetch(1000):
+            yield b"".join(orjson.dumps(dict(row)) + b"\n" for row in rows)
+
+@app.get("/scores")
+async def get_scores(if_none_match: str | None = Header(default=None)):
+    """Streams scores as newline-delimited JSON so memory stays flat for long histories.
+
+    The ETag comes from COUNT(*) and MAX(logid) over the user's scores. That aggregate still
+    reads every one of the user's rows, O(N) per request, but it returns a single row, so an
+    unchanged history sends nothing over the wire.
+    """
     try:
-        with engine.connect() as connection:
-            scores_df = pd.read_sql(sql, connection, params={"user": current_user})
-        
-        if scores_df.empty: return {"weekly": [], "monthly": []}
+        async with pg_pool.acquire() as connection:
+            count, newest = await connection.fetchrow(PG_SCORES_VERSION, CURRENT_USER)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    etag = f'"scores-{count}-{newest}"'
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return StreamingResponse(_stream_scores(CURRENT_USER), media_type="application/x-ndjson", headers={"ETag": etag})
 
-        scores_df['date'] = pd.to_datetime(scores_df['date'], errors='coerce')
-        scores_df.dropna(subset=['date'], inplace=True)
-        scores_df['score'] = pd.to_numeric(scores_df['score'], errors='coerce')
-        scores_df.dropna(subset=['score'], inplace=True)
-        
-        if scores_df.empty: return {"weekly": [], "monthly": []}
-        
-        scores_df['score'] = scores_df['score'].astype(int)
-        scores_df['year'] = scores_df['date'].dt.isocalendar().year
-        
-        scores_df['weekofyear'] = scores_df['date'].dt.isocalendar().week
-        weekly_avg = scores_df.groupby(['definitionid', 'year', 'weekofyear'])['score'].agg(['mean', 'count']).reset_index()
-        weekly_avg.rename(columns={'mean': 'averagescore', 'count': 'datapointscount'}, inplace=True)
-        
-        scores_df['month'] = scores_df['date'].dt.month
-        monthly_avg = scores_df.groupby(['definitionid', 'year', 'month'])['score'].agg(['mean', 'count']).reset_index()
-        monthly_avg.rename(columns={'mean': 'averagescore', 'count': 'datapointscount'}, inplace=True)
+# --- Averages Endpoint ---
+async def _load_averages(username: str):
+    rows = await _fetch_all(SQL_AVERAGES, {"user": username})
+    return {
+        "weekly": [{key: row[key] for key in WEEKLY_AVERAGE_KEYS} for row in rows if row["weekly"]],
+        "monthly": [{key: row[key] for key in MONTHLY_AVERAGE_KEYS} for row in rows if not row["weekly"]],
+    }
 
-        return {"weekly": weekly_avg.to_dict('records'), "monthly": monthly_avg.to_dict('records')}
+@app.get("/averages", response_model=Averages)
+async def get_averages(if_none_match: str | None = Header(default=None)):
+    try:
+        return await _cached_json("averages", CURRENT_USER, lambda: _load_averages(CURRENT_USER), if_none_match)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- Feedback Endpoint ---
 @app.post("/feedback", status_code=status.HTTP_201_CREATED)
-def submit_feedback(feedback: FeedbackCreate, current_user: str = Depends(get_current_user)):
-    sql = text("INSERT INTO feedback (username, feedback_text) VALUES (:user, :text)")
-    params = {"user": current_user, "text": feedback.feedback_text}
+async def submit_feedback(feedback: FeedbackCreate):
+    params = {"user": CURRENT_USER, "text": feedback.feedback_text}
     try:
-        with engine.connect() as connection:
-            connection.execute(sql, params)
-            connection.commit()
+        await _execute(SQL_INSERT_FEEDBACK, params)
         return {"status": "success", "message": "Thank you for your feedback!"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# --- Local Entry Point ---
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host="127.0.0.1", port=8000, loop="uvloop", http="httptools")
@@ -1,22 +1,136 @@
 # app.py
 
+import os
 import streamlit as st
-import pandas as pd
 from engine import BehaviorTracker
 from datetime import datetime
 import streamlit_authenticator as stauth
 import yaml
 from yaml.loader import SafeLoader
 import requests 
-import plotly.express as px
 
 # --- Page Configuration ---
 st.set_page_config(page_title="BeeHayv", layout="wide", page_icon="🐝")
 
+# --- Shared API Client ---
+# One tracker per process: every browser session reuses the same Session and its warm
+# keep-alive connections instead of building a new pool per login.
+@st.cache_resource
+def _get_tracker(api_url):
+    return BehaviorTracker(base_api_url=api_url)
+
+# --- Cached Reads ---
+# Every rerun (every widget change) needs the user's tables, so they are memoized per user
+# and data version. Each rerun asks the API for the version (one tiny GET); only when a
+# write has changed it do the tables get fetched again. The version only counts writes made
+# through this API process, so the TTL bounds how long other changes can go unseen.
+# The selectbox lookup dicts are derived here too, so they are built once per version
+# rather than on every rerun.
+@st.cache_data(ttl=60, max_entries=100, show_spinner=False)
+def _cached_user_tables(_tracker, username, version, include_scores=True):
+    subjects_df, defs_df, scores_df = _tracker.get_all_user_data(username, include_scores=include_scores)
+    subject_options = {} if subjects_df.empty else dict(zip(subjects_df['subjectid'].tolist(), subjects_df['subjectlabel'].tolist()))
+    definition_options = {}
+    if not defs_df.empty: # one "Subject - Behavior" label column and lookup dict shared by every selectbox
+        defs_df = defs_df.assign(display_label=defs_df['subjectlabel'].fillna('') + " - " + defs_df['behaviorname'].fillna('')) # a copy: the tracker's ETag cache shares the original
+        definition_options = dict(zip(defs_df['definitionid'].tolist(), defs_df['display_label'].tolist()))
+    return subjects_df, defs_df, scores_df, subject_options, definition_options
+
+# --- Form Callbacks ---
+# Each write runs as the submit button's on_click callback, before the rerun the submit
+# triggers anyway, so that one rerun already sees the new data version. Calling the API in
+# the script body instead needed a second, explicit st.rerun() to refresh the tables.
+# Callbacks read the submitted values from the widgets' session_state keys.
+def _on_add_subject(tracker, username):
+    label = st.session_state.add_subject_label
+    if label:
+        tracker.add_subject(username, label)
+        st.toast(f"Added: '{label}'")
+
+def _on_add_definition(tracker, username):
+    subject_id, name = st.session_state.add_definition_subject, st.session_state.add_definition_name
+    if subject_id and name:
+        tracker.add_behavior_definition(username, subject_id, name)
+        st.toast(f"Defined '{name}'.")
+
+def _on_log_score(tracker, username):
+    definition_id = st.session_state.log_score_definition
+    if definition_id:
+        score = st.session_state.log_score_value
+        tracker.log_score(username, int(definition_id), st.session_state.log_score_date, score, st.session_state.log_score_notes)
+        st.toast(f"Logged score of {score}.")
+
+def _on_update_subject(tracker, username):
+    subject_id, label = st.session_state.update_subject_id, st.session_state.update_subject_label
+    if subject_id and label:
+        tracker.update_subject(username, int(subject_id), label)
+        st.toast("Updated subject.")
+
+def _on_update_definition(tracker, username):
+    definition_id = st.session_state.update_definition_id
+    if definition_id:
+        tracker.update_definition(username, int(definition_id), st.session_state.update_definition_name, st.session_state.update_definition_desc)
+        st.toast("Updated definition.")
+
+def _on_delete_subject(tracker, username):
+    subject_id = st.session_state.delete_subject_id
+    if subject_id and st.session_state.delete_subject_confirm:
+        tracker.delete_subject(username, int(subject_id))
+        st.toast("Deleted subject.")
+
+def _on_delete_definition(tracker, username):
+    definition_id = st.session_state.delete_definition_id
+    if definition_id and st.session_state.delete_definition_confirm:
+        tracker.delete_definition(username, int(definition_id))
+        st.toast("Deleted definition.")
+
+# --- Analysis & Plotting Section ---
+# A fragment: the Calculate button and the plot selectbox/radio rerun only this function,
+# not the whole script, so they never re-fetch data or rebuild the other sections.
+@st.fragment
+def render_analysis_section(tracker, username, definition_options):
+    if st.button("📈 Calculate Averages", type="primary"):
+        with st.spinner("Calculating..."):
+            weekly_df, monthly_df = tracker.get_all_averages(username)
+            # Index by definition once here so each render is an index lookup, not a mask + sort.
+            # The API orders rows by definitionid then period, so the index is already sorted.
+            st.session_state.weekly_df = weekly_df.set_index('definitionid') if not weekly_df.empty else weekly_df
+            st.session_state.monthly_df = monthly_df.set_index('definitionid') if not monthly_df.empty else monthly_df
+            st.success("Averages calculated!")
+    if 'weekly_df' in st.session_state:
+        st.subheader("Progress Charts")
+        if not definition_options:
+            st.warning("No behaviors defined to plot.")
+            return
+        plot_col1, plot_col2 = st.columns([1, 2])
+        with plot_col1:
+            behavior_to_plot_str = st.selectbox("Select Behavior to Plot", options=[str(k) for k in definition_options.keys()], format_func=lambda x: definition_options.get(int(x)))
+            period_to_plot = st.radio("Select Period", ["Weekly", "Monthly"], horizontal=True)
+        with plot_col2:
+            if behavior_to_plot_str:
+                behavior_to_plot = int(behavior_to_plot_str)
+                avg_df = st.session_state.weekly_df if period_to_plot == "Weekly" else st.session_state.monthly_df
+                x_axis, y_axis = 'timeperiod', 'averagescore' # the API labels each period ("2024-W07" / "2024-Jan")
+                if behavior_to_plot in avg_df.index:
+                    import plotly.express as px # deferred: login and data entry never plot, so they skip its import cost
+                    plot_data = avg_df.loc[[behavior_to_plot]] # rows stay in the API's chronological order
+                    fig = px.line(plot_data, x=x_axis, y=y_axis, title=f"{period_to_plot} Progress for {definition_options.get(behavior_to_plot, 'N/A')}", markers=True, labels={x_axis: "Time Period", y_axis: "Average Score"})
+                    fig.update_yaxes(range=[0, 11]); st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("No calculated averages to plot for this specific behavior yet.")
+
 # --- Load User Authentication Config ---
-try:
+# Parsed once per file version: the mtime changes only when registration rewrites the file.
+# cache_data hands each caller its own copy, so the credentials that register_user adds
+# stay in this session's dict until they are dumped back to disk. The Authenticate
+# object is still built per run because it binds to the session's state and cookies.
+@st.cache_data(max_entries=1, show_spinner=False)
+def _load_config(mtime):
     with open('config.yaml') as file:
-        config = yaml.load(file, Loader=SafeLoader)
+        return yaml.load(file, Loader=SafeLoader)
+
+try:
+    config = _load_config(os.path.getmtime('config.yaml'))
     authenticator = stauth.Authenticate(
         config['credentials'],
         config['cookie']['name'],
@@ -42,10 +156,8 @@ if st.session_state["authentication_status"]:
     # --- Initialize The Engine to be an API Client ---
     API_URL = "http://127.0.0.1:8000" 
     try:
-        if 'tracker' not in st.session_state:
-            st.session_state.tracker = BehaviorTracker(base_api_url=API_URL)
-        tracker = st.session_state.tracker
-        health_check = requests.get(f"{API_URL}/health")
+        tracker = _get_tracker(API_URL)
+        health_check = tracker.session.get(f"{API_URL}/health", timeout=2) # reuses the tracker's pooled connection
         if health_check.status_code != 200:
             st.error("API backend not responding. Please ensure it is running.")
             st.stop()
@@ -61,93 +173,50 @@ if st.session_state["authentication_status"]:
     st.write("This app is now powered by the FastAPI backend.")
     st.divider()
 
-    tab1, tab2, tab3, tab4 = st.tabs(["📊 Data Entry & Plotting", "⚙️ Data Management", "📚 Raw Data Tables", "📝 Submit Feedback"])
+    # Sidebar navigation instead of st.tabs: tabs render (and fetch for) every section on
+    # every rerun, while only the selected section runs here.
+    SECTIONS = ["📊 Data Entry & Plotting", "⚙️ Data Management", "📚 Raw Data Tables", "📝 Submit Feedback"]
+    section = st.sidebar.radio("Section", SECTIONS)
 
-    # --- Fetch data once for all tabs ---
-    user_subjects_df = tracker.get_subjects(username)
-    user_defs_df = tracker.get_definitions(username)
+    # --- Fetch only the data the selected section needs ---
+    if section != SECTIONS[3]: # Feedback reads nothing
+        data_version = tracker.get_user_version(username)
+        user_subjects_df, user_defs_df, user_scores_df, subject_options, definition_options = _cached_user_tables(
+            tracker, username, data_version, include_scores=section == SECTIONS[2])
 
-    with tab1: # Data Entry & Plotting
+    if section == SECTIONS[0]: # Data Entry & Plotting
         st.header("1. Data Entry")
         d_col1, d_col2 = st.columns(2)
         with d_col1:
             with st.expander("➕ Add a New Subject"):
                 with st.form("add_subject_form", clear_on_submit=True):
-                    new_subject_label = st.text_input("New Subject's Name")
-                    submitted = st.form_submit_button("Add Subject")
-                    if submitted and new_subject_label:
-                        tracker.add_subject(username, new_subject_label)
-                        st.success(f"Added: '{new_subject_label}'"); st.rerun()
+                    st.text_input("New Subject's Name", key="add_subject_label")
+                    st.form_submit_button("Add Subject", on_click=_on_add_subject, args=(tracker, username))
             with st.expander("➕ Define a New Behavior"):
                 if user_subjects_df.empty:
                     st.warning("Add a subject first.")
                 else:
                     with st.form("add_definition_form", clear_on_submit=True):
-                        subject_options = pd.Series(user_subjects_df['subjectlabel'].values, index=user_subjects_df['subjectid'].values).to_dict()
-                        selected_subject_id = st.selectbox("For Subject", options=list(subject_options.keys()), format_func=lambda x: subject_options.get(x))
-                        new_behavior_name = st.text_input("New Behavior's Name")
-                        submitted = st.form_submit_button("Define Behavior")
-                        if submitted and selected_subject_id and new_behavior_name:
-                            tracker.add_behavior_definition(username, selected_subject_id, new_behavior_name)
-                            st.success(f"Defined '{new_behavior_name}'."); st.rerun()
+                        st.selectbox("For Subject", options=list(subject_options.keys()), format_func=lambda x: subject_options.get(x), key="add_definition_subject")
+                        st.text_input("New Behavior's Name", key="add_definition_name")
+                        st.form_submit_button("Define Behavior", on_click=_on_add_definition, args=(tracker, username))
         with d_col2:
             with st.expander("📝 Log a Daily Score", expanded=True):
                 if user_defs_df.empty:
                     st.warning("Define a behavior first.")
                 else:
-                    user_defs_df['display_label'] = user_defs_df['subjectlabel'].fillna('') + " - " + user_defs_df['behaviorname'].fillna('')
-                    definition_options = pd.Series(user_defs_df['display_label'].values, index=user_defs_df['definitionid'].values).to_dict()
                     with st.form("log_score_form", clear_on_submit=True):
                         options_as_strings = [str(k) for k in definition_options.keys()]
-                        selected_definition_id_str = st.selectbox("Select Behavior", options=options_as_strings, format_func=lambda x: definition_options.get(int(x), "Select..."))
-                        score_date = st.date_input("Date", value=datetime.now())
-                        score_value = st.slider("Score (1-10)", 1, 10, 5)
-                        score_notes = st.text_area("Notes (Optional)")
-                        submitted = st.form_submit_button("Log Score")
-                        if submitted and selected_definition_id_str:
-                            tracker.log_score(username, int(selected_definition_id_str), score_date, score_value, score_notes)
-                            st.success(f"Logged score of {score_value}."); st.rerun()
+                        st.selectbox("Select Behavior", options=options_as_strings, format_func=lambda x: definition_options.get(int(x), "Select..."), key="log_score_definition")
+                        st.date_input("Date", value=datetime.now(), key="log_score_date")
+                        st.slider("Score (1-10)", 1, 10, 5, key="log_score_value")
+                        st.text_area("Notes (Optional)", key="log_score_notes")
+                        st.form_submit_button("Log Score", on_click=_on_log_score, args=(tracker, username))
         st.divider()
         st.header("2. Analysis & Plotting")
-        if st.button("📈 Calculate Averages", type="primary"):
-            with st.spinner("Calculating..."):
-                weekly_df, monthly_df = tracker.get_all_averages(username)
-                st.session_state.weekly_df = weekly_df
-                st.session_state.monthly_df = monthly_df
-                st.success("Averages calculated!")
-        if 'weekly_df' in st.session_state:
-            st.subheader("Progress Charts")
-            if user_defs_df.empty:
-                st.warning("No behaviors defined to plot.")
-            else:
-                plot_col1, plot_col2 = st.columns([1, 2])
-                with plot_col1:
-                    user_defs_df['plot_display_label'] = user_defs_df['subjectlabel'].fillna('') + " - " + user_defs_df['behaviorname'].fillna('')
-                    plot_definition_options = pd.Series(user_defs_df['plot_display_label'].values, index=user_defs_df['definitionid'].values).to_dict()
-                    behavior_to_plot_str = st.selectbox("Select Behavior to Plot", options=[str(k) for k in plot_definition_options.keys()], format_func=lambda x: plot_definition_options.get(int(x)))
-                    period_to_plot = st.radio("Select Period", ["Weekly", "Monthly"], horizontal=True)
-                with plot_col2:
-                    if 'behavior_to_plot_str' in locals() and behavior_to_plot_str:
-                        behavior_to_plot = int(behavior_to_plot_str)
-                        if period_to_plot == "Weekly":
-                            avg_df = st.session_state.weekly_df
-                            if not avg_df.empty:
-                                avg_df['Time Period'] = avg_df['year'].astype(str) + "-W" + avg_df['weekofyear'].astype(str).str.zfill(2)
-                            x_axis, y_axis = 'Time Period', 'averagescore'
-                        else:
-                            avg_df = st.session_state.monthly_df
-                            if not avg_df.empty:
-                                avg_df['Time Period'] = pd.to_datetime(avg_df[['year', 'month']].assign(DAY=1)).dt.strftime('%Y-%b')
-                            x_axis, y_axis = 'Time Period', 'averagescore'
-                        if 'Time Period' in avg_df:
-                            plot_data = avg_df[avg_df['definitionid'] == behavior_to_plot].sort_values(by='Time Period')
-                            if not plot_data.empty:
-                                fig = px.line(plot_data, x=x_axis, y=y_axis, title=f"{period_to_plot} Progress for {plot_definition_options.get(behavior_to_plot, 'N/A')}", markers=True, labels={x_axis: "Time Period", y_axis: "Average Score"})
-                                fig.update_yaxes(range=[0, 11]); st.plotly_chart(fig, use_container_width=True)
-                            else:
-                                st.info("No calculated averages to plot for this specific behavior yet.")
-
-    with tab2: # Data Management
+        render_analysis_section(tracker, username, definition_options)
+
+    elif section == SECTIONS[1]: # Data Management
         st.header("Manage Your Data")
         manage_col1, manage_col2 = st.columns(2)
         with manage_col1:
@@ -155,34 +224,25 @@ if st.session_state["authentication_status"]:
             with st.expander("✏️ Update Subject Name"):
                 if not user_subjects_df.empty:
                     with st.form("update_subject_form"):
-                        subject_options = pd.Series(user_subjects_df['subjectlabel'].values, index=user_subjects_df['subjectid'].values).to_dict()
                         subject_options_keys_str = [str(k) for k in subject_options.keys()]
-                        subject_to_edit_str = st.selectbox("Subject to Update", options=subject_options_keys_str, format_func=lambda x: subject_options.get(int(x)))
-                        new_subject_label = st.text_input("New Name")
-                        submitted_update = st.form_submit_button("Update Subject")
-                        if submitted_update and subject_to_edit_str and new_subject_label:
-                            tracker.update_subject(username, int(subject_to_edit_str), new_subject_label)
-                            st.success(f"Updated subject."); st.rerun()
+                        st.selectbox("Subject to Update", options=subject_options_keys_str, format_func=lambda x: subject_options.get(int(x)), key="update_subject_id")
+                        st.text_input("New Name", key="update_subject_label")
+                        st.form_submit_button("Update Subject", on_click=_on_update_subject, args=(tracker, username))
                 else:
                     st.warning("No subjects to edit.")
             with st.expander("✏️ Update Behavior Definition"):
                  if not user_defs_df.empty:
                     with st.form("update_definition_form"):
-                        user_defs_df['mng_display_label'] = user_defs_df['subjectlabel'].fillna('') + " - " + user_defs_df['behaviorname'].fillna('')
-                        def_options = pd.Series(user_defs_df['mng_display_label'].values, index=user_defs_df['definitionid'].values).to_dict()
-                        def_options_keys_str = [str(k) for k in def_options.keys()]
-                        def_to_edit_str = st.selectbox("Definition to Update", options=def_options_keys_str, format_func=lambda x: def_options.get(int(x)))
+                        def_options_keys_str = [str(k) for k in definition_options.keys()]
+                        def_to_edit_str = st.selectbox("Definition to Update", options=def_options_keys_str, format_func=lambda x: definition_options.get(int(x)), key="update_definition_id")
                         current_name, current_desc = "", ""
                         if def_to_edit_str:
                             def_to_edit = int(def_to_edit_str)
                             current_name = user_defs_df.loc[user_defs_df['definitionid'] == def_to_edit, 'behaviorname'].iloc[0] if not user_defs_df.loc[user_defs_df['definitionid'] == def_to_edit].empty else ""
                             current_desc = user_defs_df.loc[user_defs_df['definitionid'] == def_to_edit, 'description'].iloc[0] if not user_defs_df.loc[user_defs_df['definitionid'] == def_to_edit].empty else ""
-                        new_def_name = st.text_input("New Behavior Name", value=current_name)
-                        new_def_desc = st.text_area("New Description", value=current_desc)
-                        submitted_def_update = st.form_submit_button("Update Definition")
-                        if submitted_def_update and def_to_edit_str:
-                            tracker.update_definition(username, int(def_to_edit_str), new_def_name, new_def_desc)
-                            st.success("Updated definition."); st.rerun()
+                        st.text_input("New Behavior Name", value=current_name, key="update_definition_name")
+                        st.text_area("New Description", value=current_desc, key="update_definition_desc")
+                        st.form_submit_button("Update Definition", on_click=_on_update_definition, args=(tracker, username))
                  else:
                     st.warning("No definitions to edit.")
         with manage_col2:
@@ -190,36 +250,27 @@ if st.session_state["authentication_status"]:
             with st.expander("🗑️ Delete Subject"):
                 if not user_subjects_df.empty:
                     with st.form("delete_subject_form"):
-                        subject_options_del = pd.Series(user_subjects_df['subjectlabel'].values, index=user_subjects_df['subjectid'].values).to_dict()
-                        subject_del_keys_str = [str(k) for k in subject_options_del.keys()]
-                        subject_to_delete_str = st.selectbox("Subject to Delete", options=subject_del_keys_str, format_func=lambda x: subject_options_del.get(int(x)))
-                        confirmation = st.checkbox("I am sure. This deletes the subject and ALL its data.")
-                        submitted_del = st.form_submit_button("Delete Subject Permanently")
-                        if submitted_del and subject_to_delete_str and confirmation:
-                            tracker.delete_subject(username, int(subject_to_delete_str))
-                            st.success(f"Deleted subject."); st.rerun()
+                        subject_del_keys_str = [str(k) for k in subject_options.keys()]
+                        st.selectbox("Subject to Delete", options=subject_del_keys_str, format_func=lambda x: subject_options.get(int(x)), key="delete_subject_id")
+                        st.checkbox("I am sure. This deletes the subject and ALL its data.", key="delete_subject_confirm")
+                        st.form_submit_button("Delete Subject Permanently", on_click=_on_delete_subject, args=(tracker, username))
             with st.expander("🗑️ Delete Behavior Definition"):
                 if not user_defs_df.empty:
                     with st.form("delete_definition_form"):
-                        user_defs_df['del_display_label'] = user_defs_df['subjectlabel'].fillna('') + " - " + user_defs_df['behaviorname'].fillna('')
-                        def_options_del = pd.Series(user_defs_df['del_display_label'].values, index=user_defs_df['definitionid'].values).to_dict()
-                        def_del_keys_str = [str(k) for k in def_options_del.keys()]
-                        def_to_delete_str = st.selectbox("Definition to Delete", options=def_del_keys_str, format_func=lambda x: def_options_del.get(int(x)))
-                        conf_del_def = st.checkbox("I am sure. This deletes the definition and its scores.")
-                        submitted_del_def = st.form_submit_button("Delete Definition Permanently")
-                        if submitted_del_def and def_to_delete_str and conf_del_def:
-                            tracker.delete_definition(username, int(def_to_delete_str))
-                            st.success("Deleted definition."); st.rerun()
-    with tab3:
+                        def_del_keys_str = [str(k) for k in definition_options.keys()]
+                        st.selectbox("Definition to Delete", options=def_del_keys_str, format_func=lambda x: definition_options.get(int(x)), key="delete_definition_id")
+                        st.checkbox("I am sure. This deletes the definition and its scores.", key="delete_definition_confirm")
+                        st.form_submit_button("Delete Definition Permanently", on_click=_on_delete_definition, args=(tracker, username))
+    elif section == SECTIONS[2]: # Raw Data Tables
         st.header("Raw Data Views")
         st.subheader("Subjects Table")
         st.dataframe(user_subjects_df)
         st.subheader("Definitions Table")
         st.dataframe(user_defs_df)
         st.subheader("Daily Scores Log")
-        st.dataframe(tracker.get_daily_scores(username))
+        st.dataframe(user_scores_df)
     
-    with tab4:
+    else: # Submit Feedback
         st.header("Submit Feedback")
         st.write("Find a bug or have a suggestion? Let us know!")
         with st.form("feedback_form", clear_on_submit=True):
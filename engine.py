@@ -1,78 +1,329 @@
 # engine.py
 
+import asyncio
+import logging
+import httpx
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import pyarrow as pa
+import pyarrow.json as pa_json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 
+logger = logging.getLogger(__name__)
+
+# Columns and dtypes of each API payload (they mirror the response models in api.py).
+# Fixing them up front skips pandas' per-call inference, keeps column order stable and
+# gives empty results the same columns as full ones.
+SUBJECT_COLUMNS = ("subjectid", "username", "subjectlabel", "datecreated")
+SUBJECT_DTYPES = {"subjectid": "int32", "username": "string", "subjectlabel": "string"}
+DEFINITION_COLUMNS = ("definitionid", "subjectid", "username", "behaviorname", "description", "subjectlabel")
+# description stays object: it is nullable, and the edit form must prefill a NULL as empty, not "<NA>"
+DEFINITION_DTYPES = {"definitionid": "int32", "subjectid": "int32", "username": "string", "behaviorname": "string", "subjectlabel": "string"}
+WEEKLY_AVERAGE_COLUMNS = ("definitionid", "year", "weekofyear", "timeperiod", "averagescore", "datapointscount")
+MONTHLY_AVERAGE_COLUMNS = ("definitionid", "year", "month", "timeperiod", "averagescore", "datapointscount")
+AVERAGE_DTYPES = {"definitionid": "int32", "year": "int16", "weekofyear": "int8", "month": "int8", "timeperiod": "string", "averagescore": "float64", "datapointscount": "int32"}
+
+def _to_frame(records, columns, dtypes, parse_dates=()) -> pd.DataFrame:
+    """Builds a DataFrame from API records with fixed columns and dtypes, parsing ISO date strings once into datetime64 columns."""
+    df = pd.DataFrame.from_records(records, columns=columns)
+    df = df.astype({column: dtype for column, dtype in dtypes.items() if column in df}, copy=False)
+    for column in parse_dates:
+        if column in df:
+            df[column] = pd.to_datetime(df[column], utc=column == "datecreated") # only timestamps carry an offset
+    return df
+
+# /scores is NDJSON and parsed by Arrow straight into columns, with no per-row dicts.
+# Dates arrive as "YYYY-MM-DD", which Arrow reads as timestamps but not as date32.
+SCORE_SCHEMA = pa.schema([
+    ("logid", pa.int32()), ("definitionid", pa.int32()), ("username", pa.string()),
+    ("date", pa.timestamp("s")), ("score", pa.int32()), ("notes", pa.string()),
+])
+_ARROW_STRING_TYPES = {pa.string(): pd.StringDtype()}.get # Arrow strings -> pandas "string", like the other frames
+
+def _read_ndjson(body: bytes, schema: pa.Schema) -> pd.DataFrame:
+    """Parses an NDJSON body into a DataFrame with the schema's columns and types."""
+    if not body: # Arrow rejects an empty input, but an empty body just means no rows
+        return schema.empty_table().to_pandas(types_mapper=_ARROW_STRING_TYPES)
+    parse_options = pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore")
+    table = pa_json.read_json(pa.BufferReader(body), parse_options=parse_options)
+    return table.to_pandas(types_mapper=_ARROW_STRING_TYPES)
+
+# Body parsers, shared by both trackers.
+def _parse_subjects(body: bytes) -> pd.DataFrame:
+    return _to_frame(orjson.loads(body), SUBJECT_COLUMNS, SUBJECT_DTYPES, parse_dates=("datecreated",))
+
+def _parse_definitions(body: bytes) -> pd.DataFrame:
+    return _to_frame(orjson.loads(body), DEFINITION_COLUMNS, DEFINITION_DTYPES)
+
+def _parse_scores(body: bytes) -> pd.DataFrame:
+    return _read_ndjson(body, SCORE_SCHEMA)
+
+def _parse_averages(body: bytes):
+    data = orjson.loads(body)
+    weekly_df = _to_frame(data.get('weekly', []), WEEKLY_AVERAGE_COLUMNS, AVERAGE_DTYPES)
+    monthly_df = _to_frame(data.get('monthly', []), MONTHLY_AVERAGE_COLUMNS, AVERAGE_DTYPES)
+    return weekly_df, monthly_df
+
+_JSON_CONTENT_TYPE = {"content-type": "application/json"}
+
+# Every path the tracker calls; the "%d" entries take a row id.
+_ENDPOINTS = ("/version", "/subjects", "/subjects/%d", "/definitions", "/definitions/%d", "/scores", "/scores/batch", "/averages", "/feedback")
+
 class BehaviorTracker:
-    def __init__(self, base_api_url: str):
+    """
+    Synchronous client for the BeeHayv API.
+
+    One tracker is shared by every Streamlit session in the process, and each rerun fans out
+    up to four GETs on threads. The pool therefore keeps POOL_MAXSIZE connections to the single
+    API host. Past that many requests in flight, urllib3 does not block (pool_block=False) but
+    opens throwaway connections, so concurrent fan-out should stay under this number.
+    """
+    POOL_MAXSIZE = 20
+
+    def __init__(self, base_api_url: str, session: requests.Session | None = None, timeout: float = 5.0):
         """
         Initializes the engine with the base URL of the FastAPI server.
+        Pass an existing requests.Session to share its keep-alive connection pool; the
+        caller then keeps ownership and close() leaves it open.
         """
         self.base_url = base_api_url
-        self.headers = {"accept": "application/json"}
-
-    def _make_request(self, method: str, endpoint: str, **kwargs):
-        """A helper method to make requests and handle errors."""
-        try:
-            response = requests.request(method, f"{self.base_url}{endpoint}", headers=self.headers, **kwargs)
-            response.raise_for_status() # Raises an error for bad status codes (4xx or 5xx)
-            if response.status_code == 204: # No Content success status (for DELETE)
-                return None
-            return response.json()
-        except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err} - {response.text}")
-            raise
-        except Exception as err:
-            print(f"Other error occurred: {err}")
-            raise
+        self.timeout = timeout
+        self._owns_session = session is None
+        self.session = session or self._build_session()
+        self.session.headers["accept"] = "application/json" # sent by the session, not rebuilt per call
+        self._url = {endpoint: base_api_url + endpoint for endpoint in _ENDPOINTS} # joined once, not per request
+        self._cache: dict[tuple[str, str], tuple[str, object]] = {} # (username, url) -> (ETag, parsed frames)
+
+    @staticmethod
+    def _build_session() -> requests.Session:
+        """
+        Creates a Session whose pooled connections are reused across calls.
+        Connection errors, 429 and 502/503/504 from a restarting API are retried with backoff,
+        honouring Retry-After. Only idempotent methods are retried, so a POST is never sent twice.
+        Once retries run out the last response is returned, and _send's status check reports it as usual.
+        """
+        session = requests.Session()
+        retries = Retry(
+            total=3, connect=3, read=3, status=3, backoff_factor=0.25,
+            status_forcelist=(429, 502, 503, 504), allowed_methods=frozenset(("GET", "PUT", "DELETE")),
+            raise_on_status=False, respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=BehaviorTracker.POOL_MAXSIZE, pool_block=False, max_retries=retries)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self):
+        """Closes the pooled connections held by the session, unless the caller supplied it."""
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request, logging and re-raising 4xx/5xx responses. `url` is a prejoined entry of self._url."""
+        kwargs.setdefault("timeout", self.timeout) # requests never times out on its own
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code >= 400: # one int compare on the success path, unlike raise_for_status()
+            logger.warning("%s %s -> %s: %s", method.upper(), url, response.status_code, response.text)
+            raise requests.exceptions.HTTPError(f"{response.status_code} error for {method.upper()} {url}", response=response)
+        return response
+
+    def _make_request(self, method: str, url: str, json=None, **kwargs):
+        """A helper method to make requests and decode their JSON body."""
+        if json is not None: # encoded by orjson (which also handles dates) instead of requests' stdlib json
+            kwargs["data"] = orjson.dumps(json)
+            kwargs["headers"] = _JSON_CONTENT_TYPE
+        response = self._send(method, url, **kwargs)
+        if response.status_code == 204: # No Content success status (for DELETE)
+            return None
+        return orjson.loads(response.content) if response.content else None # faster than response.json()'s stdlib decode
+
+    def _get_cached(self, username: str, url: str, parse):
+        """
+        Conditional GET: sends the ETag of the last response for this URL, and on 304 Not Modified
+        returns the frames parsed from it instead of downloading and parsing the body again.
+        The cached frames are shared between calls, so callers must not modify them in place.
+        """
+        key = (username, url)
+        cached = self._cache.get(key)
+        response = self._send("get", url, headers={"If-None-Match": cached[0]} if cached else None)
+        if response.status_code == 304:
+            return cached[1]
+        parsed = parse(response.content)
+        if etag := response.headers.get("ETag"):
+            self._cache[key] = (etag, parsed)
+        return parsed
 
     # --- DATA READING METHODS ---
+    def get_user_version(self, username: str) -> str:
+        """Returns the API's data version for the user; it changes after every write."""
+        return self._make_request("get", self._url["/version"])["version"]
+
     def get_subjects(self, username: str) -> pd.DataFrame:
-        data = self._make_request("get", "/subjects")
-        return pd.DataFrame(data)
+        return self._get_cached(username, self._url["/subjects"], _parse_subjects)
 
     def get_definitions(self, username: str) -> pd.DataFrame:
-        data = self._make_request("get", "/definitions")
-        return pd.DataFrame(data)
+        return self._get_cached(username, self._url["/definitions"], _parse_definitions)
 
     def get_daily_scores(self, username: str) -> pd.DataFrame:
-        data = self._make_request("get", "/scores")
-        return pd.DataFrame(data)
+        return self._get_cached(username, self._url["/scores"], _parse_scores)
         
+    def get_all_user_data(self, username: str, include_scores: bool = True):
+        """
+        Fetches subjects, definitions and (unless include_scores is False, in which
+        case None is returned in its place) daily scores in one call.
+        The GETs run concurrently over the pooled session, so this costs the
+        slowest request rather than the sum.
+        """
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            subjects = executor.submit(self.get_subjects, username)
+            definitions = executor.submit(self.get_definitions, username)
+            scores = executor.submit(self.get_daily_scores, username) if include_scores else None
+            return subjects.result(), definitions.result(), scores.result() if scores is not None else None
+
     def get_all_averages(self, username: str):
-        data = self._make_request("get", "/averages")
-        weekly_df = pd.DataFrame(data.get('weekly', []))
-        monthly_df = pd.DataFrame(data.get('monthly', []))
-        return weekly_df, monthly_df
+        return self._get_cached(username, self._url["/averages"], _parse_averages)
+
+    def refresh_all(self, username: str):
+        """
+        Fetches subjects, definitions, daily scores and (weekly, monthly) averages concurrently,
+        in the same order as AsyncBehaviorTracker.refresh_all. The averages GET runs on its own
+        thread while get_all_user_data fans out the other three.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            averages = executor.submit(self.get_all_averages, username)
+            return (*self.get_all_user_data(username), averages.result())
 
     # --- DATA WRITING METHODS ---
     def add_subject(self, username: str, subject_label: str):
-        return self._make_request("post", "/subjects", json={"subject_label": subject_label})
+        return self._make_request("post", self._url["/subjects"], json={"subject_label": subject_label})
 
     def add_behavior_definition(self, username: str, subject_id: int, behavior_name: str, description: str = ""):
         payload = {"subject_id": subject_id, "behavior_name": behavior_name, "description": description}
-        return self._make_request("post", "/definitions", json=payload)
+        return self._make_request("post", self._url["/definitions"], json=payload)
 
     def log_score(self, username: str, definition_id: int, score_date: date, score: int, notes: str = ""):
-        payload = {"definition_id": definition_id, "score_date": score_date.isoformat(), "score": score, "notes": notes}
-        return self._make_request("post", "/scores", json=payload)
+        """Logs one score through the batch endpoint, so single and bulk writes share one server path."""
+        entry = {"definition_id": definition_id, "score_date": score_date, "score": score, "notes": notes}
+        return self.log_scores_bulk(username, [entry])[0]
     
+    def log_scores_bulk(self, username: str, entries: list[dict]):
+        """
+        Logs many scores in one request via /scores/batch, which inserts them with a single statement.
+        Each entry has definition_id, score_date (a date), score and optional notes.
+        """
+        payload = [
+            {"definition_id": e["definition_id"], "score_date": e["score_date"], "score": e["score"], "notes": e.get("notes", "")}
+            for e in entries
+        ]
+        return self._make_request("post", self._url["/scores/batch"], json=payload)
+
     def submit_feedback(self, username: str, feedback_text: str):
         """Submits user feedback by calling the API."""
-        return self._make_request("post", "/feedback", json={"feedback_text": feedback_text})
+        return self._make_request("post", self._url["/feedback"], json={"feedback_text": feedback_text})
         
     # --- EDITING METHODS ---
     def update_subject(self, username: str, subject_id: int, new_label: str):
-        return self._make_request("put", f"/subjects/{subject_id}", json={"subject_label": new_label})
+        return self._make_request("put", self._url["/subjects/%d"] % subject_id, json={"subject_label": new_label})
 
     def update_definition(self, username: str, definition_id: int, new_name: str, new_description: str):
         payload = {"behavior_name": new_name, "description": new_description}
-        return self._make_request("put", f"/definitions/{definition_id}", json=payload)
+        return self._make_request("put", self._url["/definitions/%d"] % definition_id, json=payload)
 
     # --- DELETING METHODS ---
     def delete_subject(self, username: str, subject_id: int):
-        return self._make_request("delete", f"/subjects/{subject_id}")
+        return self._make_request("delete", self._url["/subjects/%d"] % subject_id)
         
     def delete_definition(self, username: str, definition_id: int):
-        return self._make_request("delete", f"/definitions/{definition_id}")
+        return self._make_request("delete", self._url["/definitions/%d"] % definition_id)
+
+
+class AsyncBehaviorTracker:
+    def __init__(self, base_api_url: str, client: httpx.AsyncClient | None = None, timeout: float = 5.0, http2: bool = False):
+        """
+        Async twin of BehaviorTracker's read methods, for callers that already run an event loop.
+        Independent GETs are awaited together, so a full refresh costs the slowest request.
+        Pass an existing httpx.AsyncClient to share its connection pool; aclose() then leaves it open.
+        Set http2=True when the API sits behind a proxy that terminates HTTP/2 over TLS: the
+        concurrent GETs then share one multiplexed connection. Uvicorn itself speaks only HTTP/1.1,
+        and against it httpx falls back to one connection per in-flight request.
+        """
+        self.base_url = base_api_url
+        self._owns_client = client is None
+        self.client = client or httpx.AsyncClient(
+            base_url=base_api_url, headers={"accept": "application/json"}, timeout=timeout, http2=http2,
+            limits=httpx.Limits(max_keepalive_connections=8, max_connections=32),
+        )
+        self._cache: dict[tuple[str, str], tuple[str, object]] = {} # (username, endpoint) -> (ETag, parsed frames)
+
+    async def aclose(self):
+        """Closes the pooled connections held by the client, unless the caller supplied it."""
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _send(self, method: str, endpoint: str, **kwargs) -> httpx.Response:
+        """Sends a request, logging and re-raising 4xx/5xx responses."""
+        response = await self.client.request(method, endpoint, **kwargs)
+        if response.status_code >= 400: # httpx's raise_for_status() would also reject the 304s _get_cached expects
+            logger.warning("%s %s -> %s: %s", method.upper(), endpoint, response.status_code, response.text)
+            raise httpx.HTTPStatusError(f"{response.status_code} error for {method.upper()} {endpoint}", request=response.request, response=response)
+        return response
+
+    async def _make_request(self, method: str, endpoint: str, **kwargs):
+        """A helper method to make requests and decode their JSON body."""
+        response = await self._send(method, endpoint, **kwargs)
+        if response.status_code == 204: # No Content success status (for DELETE)
+            return None
+        return orjson.loads(response.content) if response.content else None # faster than response.json()'s stdlib decode
+
+    async def _get_cached(self, username: str, endpoint: str, parse):
+        """Conditional GET, as in BehaviorTracker._get_cached."""
+        key = (username, endpoint)
+        cached = self._cache.get(key)
+        response = await self._send("get", endpoint, headers={"If-None-Match": cached[0]} if cached else None)
+        if response.status_code == 304:
+            return cached[1]
+        parsed = parse(response.content)
+        if etag := response.headers.get("ETag"):
+            self._cache[key] = (etag, parsed)
+        return parsed
+
+    # --- DATA READING METHODS ---
+    async def get_user_version(self, username: str) -> str:
+        return (await self._make_request("get", "/version"))["version"]
+
+    async def get_subjects(self, username: str) -> pd.DataFrame:
+        return await self._get_cached(username, "/subjects", _parse_subjects)
+
+    async def get_definitions(self, username: str) -> pd.DataFrame:
+        return await self._get_cached(username, "/definitions", _parse_definitions)
+
+    async def get_daily_scores(self, username: str) -> pd.DataFrame:
+        return await self._get_cached(username, "/scores", _parse_scores)
+
+    async def get_all_averages(self, username: str):
+        return await self._get_cached(username, "/averages", _parse_averages)
+
+    async def refresh_all(self, username: str):
+        """Fetches subjects, definitions, daily scores and (weekly, monthly) averages concurrently."""
+        return await asyncio.gather(
+            self.get_subjects(username),
+            self.get_definitions(username),
+            self.get_daily_scores(username),
+            self.get_all_averages(username),
+        )
@@ -1,21 +1,42 @@
 import bcrypt
 import sys
+import time
+
+def _pick_cost(target_ms=250, lo=10, hi=16):
+    # Returns the largest bcrypt cost whose hash on this machine fits in target_ms,
+    # never below lo (a security floor) or above hi. Each step doubles the work,
+    # so the search stops at the first cost that runs over.
+    cost, elapsed_ms = lo, 0.0
+    for rounds in range(lo, hi + 1):
+        t0 = time.perf_counter()
+        bcrypt.hashpw(b"x", bcrypt.gensalt(rounds))
+        dt = (time.perf_counter() - t0) * 1000
+        if dt > target_ms:
+            if rounds == lo: # even the floor is over budget; use it rather than trying slower costs
+                cost, elapsed_ms = lo, dt
+            break
+        cost, elapsed_ms = rounds, dt
+    return cost, elapsed_ms
 
 try:
+    # Calibrate the cost so a login check takes about 250 ms on this hardware
+    cost, elapsed_ms = _pick_cost()
+    print(f"Using bcrypt cost {cost} ({elapsed_ms:.0f} ms per hash on this machine)")
+
     # This script will prompt you for a password and securely hash it using bcrypt.
     password_to_hash = input("Enter a password to hash: ")
 
     # Convert the password to bytes, which bcrypt requires
     password_bytes = password_to_hash.encode('utf-8')
 
-    # Generate a salt
-    salt = bcrypt.gensalt()
+    # Generate a salt with the calibrated cost
+    salt = bcrypt.gensalt(rounds=cost)
 
     # Hash the password with the salt
     hashed_password_bytes = bcrypt.hashpw(password_bytes, salt)
 
-    # Decode the hashed bytes back into a string for storage
-    hashed_password_str = hashed_password_bytes.decode('utf-8')
+    # Decode the hashed bytes back into a string for storage (bcrypt output is always ASCII)
+    hashed_password_str = hashed_password_bytes.decode('ascii')
 
     print("\n✅--- HASHED PASSWORD (for config.yaml) ---✅")
     print(f"'{hashed_password_str}'")
@@ -24,4 +45,4 @@ try:
 
 except Exception as e:
     print(f"\n❌ An error occurred. Did you install bcrypt? Error: {e}")
-    sys.exit(1)
\ No newline at end of file
+    sys.exit(1)